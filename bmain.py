@@ -6,17 +6,33 @@ Minimal, robust fixes to JSON parsing for clustering responses.
 """
 
 import os
-import json
+import orjson
 import requests
 import time
 import sys
 import re
-from xml.etree import ElementTree as ET
+import hashlib
+import random
+import calendar
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from xml.sax.saxutils import escape
+from lxml import etree as LET
 from datetime import datetime, timedelta, timezone
 from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit, urlunsplit
 
 # ---------- CONFIG ----------
 MAX_FEED_ITEMS = 100
+MIN_CALL_INTERVAL = 61  # seconds between the starts of consecutive model API calls
+MAX_API_ATTEMPTS = 3  # per model call; transient 429/5xx/network errors are retried first
+API_RETRY_BACKOFF = 30  # seconds added to MIN_CALL_INTERVAL before the first retry, doubled per retry, +0-25% jitter
+FEED_CACHE_FILE = "feed_cache.json"  # ETag/Last-Modified + raw items per feed URL
+MODEL_CACHE_TTL = 48 * 3600  # seconds a title's cached votes stay valid (longer than the 26h window)
+MODEL_CACHE_FILE = "bmain_model_cache.json"  # model votes per title, keyed by model + prompt + title hash
 URLS = [
     "https://evilgodfahim.github.io/gpd/daily_feed.xml",
     "https://evilgodfahim.github.io/daily/daily_master.xml",
@@ -34,240 +50,436 @@ MODELS = [
 GOOGLE_API_KEY = os.environ.get("PO")
 GOOGLE_API_URL = "https://generativelanguage.googleapis.com/v1beta/models"
 SYSTEM_PROMPT = """You are a Geopolitical Intelligence Filter.
-Return ONLY a JSON array of article IDs (integers) that are geopolitically significant.
-No explanation, no text, JSON only."""
+Return ONLY a JSON array of article IDs (integers) that are geopolitically significant."""
 DEBUG = False
+# Shared keep-alive pool for feed and API calls. Adapter retry only covers idempotent
+# requests (feed GETs); call_model retries API POSTs on 429/5xx/network errors, clustering exits.
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=8,
+    pool_maxsize=16,
+    max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=[502, 503, 504]),
+))
+SESSION.headers.update({'User-Agent': 'Geopolitical-Curator/1.0'})
 
 # ---------- HELPERS ----------
 def now_str():
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
+_last_call_ts = float('-inf')
+
+def wait_for_call_slot():
+    # Sleep only for whatever is left of MIN_CALL_INTERVAL since the previous call started.
+    global _last_call_ts
+    wait = MIN_CALL_INTERVAL - (time.monotonic() - _last_call_ts)
+    if wait > 0:
+        print(f"      Waiting {wait:.0f}s for rate limit...", flush=True)
+        time.sleep(wait)
+    _last_call_ts = time.monotonic()
+
+def defer_next_call(seconds):
+    # The next call starts no sooner than `seconds` from now; the usual spacing still applies if it ends later.
+    global _last_call_ts
+    _last_call_ts = max(_last_call_ts, time.monotonic() + seconds - MIN_CALL_INTERVAL)
+
 def write_feed_xml(data, filename):
     os.makedirs(os.path.dirname(filename) if os.path.dirname(filename) else ".", exist_ok=True)
-    rss = ET.Element("rss", version="2.0")
-    channel = ET.SubElement(rss, "channel")
-    ET.SubElement(channel, "title").text = "Geopolitical Intelligence Feed"
-    ET.SubElement(channel, "lastBuildDate").text = datetime.now().strftime("%a, %d %b %Y %H:%M:%S +0600")
-    ET.SubElement(channel, "link").text = "https://github.com/evilgodfahim"
-    ET.SubElement(channel, "description").text = "AI-curated geopolitical news feed"
-    if not data:
-        item = ET.SubElement(channel, "item")
-        ET.SubElement(item, "title").text = "End of Feed"
-        ET.SubElement(item, "description").text = "No geopolitically significant articles found."
-        ET.SubElement(item, "pubDate").text = datetime.now().strftime("%a, %d %b %Y %H:%M:%S +0600")
-    else:
-        for art in data:
-            item = ET.SubElement(channel, "item")
-            ET.SubElement(item, "title").text = art.get('title', 'No Title')
-            ET.SubElement(item, "link").text = art.get('link', '')
-            ET.SubElement(item, "pubDate").text = art.get('pubDate', datetime.now().strftime("%a, %d %b %Y %H:%M:%S +0000"))
-            models_str = ", ".join(art.get('selected_by', ['Unknown']))
-            category_info = art.get('category', 'Geopolitical')
-            reason_info = art.get('reason', 'Geopolitically Significant')
-            html_desc = f"<p><b>[{category_info}]</b></p>"
-            html_desc += f"<p><i>{reason_info}</i></p>"
-            html_desc += f"<p><small>Selected by: {models_str}</small></p>"
-            html_desc += f"<hr/><p>{art.get('description','')}</p>"
-            ET.SubElement(item, "description").text = html_desc
-    tree = ET.ElementTree(rss)
-    try:
-        ET.indent(tree, space="  ", level=0)
-    except Exception:
-        pass
-    tree.write(filename, encoding="utf-8", xml_declaration=True)
+    now = datetime.now()
+    rfc_local = now.strftime("%a, %d %b %Y %H:%M:%S +0600")
+    rfc_utc = now.strftime("%a, %d %b %Y %H:%M:%S +0000")
+    # Fixed RSS shape: stream each item straight to a temp file, no tree and no whole-document buffer.
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "w", encoding="utf-8", newline="") as f:
+        f.write(
+            "<?xml version='1.0' encoding='utf-8'?>\n"
+            '<rss version="2.0">\n'
+            "  <channel>\n"
+            "    <title>Geopolitical Intelligence Feed</title>\n"
+            f"    <lastBuildDate>{rfc_local}</lastBuildDate>\n"
+            "    <link>https://github.com/evilgodfahim</link>\n"
+            "    <description>AI-curated geopolitical news feed</description>\n"
+        )
+        if not data:
+            f.write(
+                "    <item>\n"
+                "      <title>End of Feed</title>\n"
+                "      <description>No geopolitically significant articles found.</description>\n"
+                f"      <pubDate>{rfc_local}</pubDate>\n"
+                "    </item>\n"
+            )
+        else:
+            for art in data:
+                models_str = ", ".join(art.get('selected_by', ['Unknown']))
+                html_desc = (
+                    f"<p><b>[{art.get('category', 'Geopolitical')}]</b></p>"
+                    f"<p><i>{art.get('reason', 'Geopolitically Significant')}</i></p>"
+                    f"<p><small>Selected by: {models_str}</small></p>"
+                    f"<hr/><p>{art.get('description','')}</p>"
+                )
+                # HTML body goes out as CDATA: no entity escaping, and readers get the markup verbatim.
+                f.write(
+                    "    <item>\n"
+                    f"      <title>{escape(art.get('title', 'No Title'))}</title>\n"
+                    f"      <link>{escape(art.get('link', ''))}</link>\n"
+                    f"      <pubDate>{escape(art.get('pubDate') or rfc_utc)}</pubDate>\n"
+                    f"      <description><![CDATA[{html_desc.replace(']]>', ']]]]><![CDATA[>')}]]></description>\n"
+                    "    </item>\n"
+                )
+        f.write("  </channel>\n</rss>")
+    # Readers never see a half-written feed: the finished file replaces the old one in one step.
+    os.replace(tmp_filename, filename)
     print(f"   Saved {len(data)} items to {filename}", flush=True)
 
 # ---------- FETCH ----------
+_ITEM_FIELDS = ('pubDate', 'title', 'description', 'link', 'guid')
+_TRACKING_PARAMS = ('utm_', 'fbclid', 'gclid')
+
+def canonical_link(link):
+    # Dedup key only: lower-case scheme/host, drop tracking params, trailing slash and fragment.
+    try:
+        p = urlsplit(link.strip())
+    except ValueError:
+        # Malformed (e.g. "http://[abc/x"): dedup on the raw link rather than lose the rest of the feed.
+        return link.strip()
+    scheme = p.scheme.lower()
+    if scheme == 'http':
+        scheme = 'https'
+    query = '&'.join(
+        kv for kv in p.query.split('&')
+        if kv and not kv.split('=', 1)[0].lower().startswith(_TRACKING_PARAMS)
+    )
+    return urlunsplit((scheme, p.netloc.lower(), p.path.rstrip('/'), query, ''))
+
+# "Thu, 05 Oct 2026 14:03:00 +0600": the shape nearly every feed uses.
+_RFC822_RE = re.compile(r'(?:\w{3}, )?(\d{1,2}) (\w{3}) (\d{4}) (\d{2}):(\d{2}):(\d{2}) ([+-])(\d{2})(\d{2})$')
+_MONTHS = {m: i for i, m in enumerate(("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"), 1)}
+
+@lru_cache(maxsize=4096)
+def pub_timestamp(pub_date):
+    # Mirrored feeds repeat the same pubDate strings; parse each one once per run.
+    m = _RFC822_RE.match(pub_date.strip())
+    if m and m.group(2) in _MONTHS:
+        day, year, hh, mm, ss, off_h, off_m = (int(m.group(i)) for i in (1, 3, 4, 5, 6, 8, 9))
+        mon = _MONTHS[m.group(2)]
+        # timegm would roll "31 Feb" or hour 24 over; only in-range stamps take the fast path.
+        if year >= 1 and 1 <= day <= calendar.monthrange(year, mon)[1] and hh < 24 and mm < 60 and ss < 60 and off_h < 24 and off_m < 60:
+            offset = (off_h * 3600 + off_m * 60) * (1 if m.group(7) == '+' else -1)
+            return calendar.timegm((year, mon, day, hh, mm, ss)) - offset
+    # Anything else (GMT/EST names, odd spacing, impossible dates) goes through the full RFC 2822 parser.
+    dt = parsedate_to_datetime(pub_date)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+def load_json_cache(path):
+    try:
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return {}
+
+def save_json_cache(path, cache):
+    with open(path, "wb") as f:
+        f.write(orjson.dumps(cache))
+
+def _fetch_one(url, cached):
+    log = [f"Fetching: {url}"]
+    headers = {}
+    if cached.get('etag'):
+        headers['If-None-Match'] = cached['etag']
+    if cached.get('last_modified'):
+        headers['If-Modified-Since'] = cached['last_modified']
+    try:
+        r = SESSION.get(url, headers=headers, timeout=15, stream=True)
+    except Exception as e:
+        log.append(f"  ❌ Error: {e}")
+        return url, None, None, None, False, log
+    with r:
+        log.append(f"  Status: {r.status_code}")
+        if r.status_code == 304:
+            log.append("  Not modified, reusing cached items")
+            return url, r.status_code, None, None, True, log
+        if r.status_code != 200:
+            log.append("  ❌ Failed to fetch feed")
+            return url, None, None, None, False, log
+        # Parse while the body is still downloading; a broken feed keeps the items read so far.
+        items = []
+        # complete only catches transport errors and hard parse failures: recover=True repairs bad markup
+        # silently (lxml leaves error_log empty), so a recovered feed still counts as complete and is cached.
+        complete = True
+        try:
+            for fields in _iter_feed_items(r.iter_content(65536)):
+                items.append(fields)
+        except LET.XMLSyntaxError as e:
+            log.append(f"  ❌ XML Parse Error: {e}")
+            complete = False
+        except requests.exceptions.RequestException as e:
+            log.append(f"  ❌ Error: {e}")
+            complete = False
+        except Exception as e:
+            # Anything else would escape pool.map and end the whole run; skip just this feed.
+            log.append(f"  ❌ Error: {e}")
+            return url, None, None, None, False, log
+        return url, r.status_code, r.headers, items, complete, log
+
+def _iter_feed_items(chunks):
+    # recover: a stray '&' or bad tag in one item must not cost the rest of the feed.
+    parser = LET.XMLPullParser(events=('end',), tag='item', resolve_entities=False, recover=True, huge_tree=True)
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from _read_items(parser)
+    parser.close()
+    yield from _read_items(parser)
+
+def _read_items(parser):
+    for _, item in parser.read_events():
+        fields = dict.fromkeys(_ITEM_FIELDS)
+        for child in item:
+            tag = child.tag
+            if tag in fields and fields[tag] is None:
+                fields[tag] = child.text or ""
+        # Free the parsed item and everything before it; only one item stays in memory.
+        item.clear()
+        while item.getprevious() is not None:
+            del item.getparent()[0]
+        yield fields
+
 def fetch_titles_only():
     all_articles = []
     seen_links = set()
+    next_id = 0
     now = datetime.now(timezone.utc)
     cutoff_time = now - timedelta(hours=26)
+    cutoff_ts = cutoff_time.timestamp()
+    # Stamp for undated items, formatted once per fetch from the same UTC "now" as the cutoff.
+    fallback_pub_date = now.strftime("%a, %d %b %Y %H:%M:%S +0000")
     print(f"Time Filter: Articles after {cutoff_time.strftime('%Y-%m-%d %H:%M UTC')}", flush=True)
-    headers = {'User-Agent': 'Geopolitical-Curator/1.0'}
-    for url in URLS:
-        print(f"Fetching: {url}", flush=True)
+    feed_cache = load_json_cache(FEED_CACHE_FILE)
+    # Download and parse every feed concurrently; filtering and dedup stay in this thread, in URLS order.
+    with ThreadPoolExecutor(max_workers=len(URLS)) as pool:
+        results = list(pool.map(lambda u: _fetch_one(u, feed_cache.get(u, {})), URLS))
+    for url, status, headers, items, complete, log in results:
+        for line in log:
+            print(line, flush=True)
+        if status is None:
+            continue
+        if status == 304:
+            feed_items = feed_cache.get(url, {}).get('items', [])
+        else:
+            feed_items = items
+        # Every raw item as parsed, so an unchanged (304) feed can be re-filtered in full next run.
+        raw_items = feed_items
+        items_added = 0
         try:
-            r = requests.get(url, headers=headers, timeout=15)
-            print(f"  Status: {r.status_code}", flush=True)
-            if r.status_code != 200:
-                print("  ❌ Failed to fetch feed", flush=True)
-                continue
-            try:
-                root = ET.fromstring(r.content)
-            except Exception as e:
-                print(f"  ❌ XML Parse Error: {e}", flush=True)
-                continue
-            items = root.findall('.//item')
-            print(f"  Found {len(items)} total items", flush=True)
-            items_added = 0
-            for item in items:
-                pub_date = item.findtext('pubDate') or ""
-                if not pub_date:
-                    pub_date = datetime.now().strftime("%a, %d %b %Y %H:%M:%S +0000")
-                try:
-                    dt = parsedate_to_datetime(pub_date)
-                    if dt.tzinfo is None:
-                        dt = dt.replace(tzinfo=timezone.utc)
-                    else:
-                        dt = dt.astimezone(timezone.utc)
-                    if dt < cutoff_time:
-                        continue
-                except Exception:
-                    pass
-                link = item.findtext('link') or ""
+            for fields in feed_items:
+                link = fields['link'] or fields['guid'] or ""
                 if not link:
-                    guid = item.find('guid')
-                    link = guid.text if guid is not None else ""
-                if not link or link in seen_links:
                     continue
-                title = (item.findtext('title') or "No Title").strip()
-                desc_text = item.findtext('description') or title
+                pub_date = fields['pubDate'] or ""
+                if not pub_date:
+                    # Undated items count as fresh; no need to parse the stamp made for them here.
+                    pub_date = fallback_pub_date
+                else:
+                    try:
+                        # No early exit on a run of stale items: aggregated feeds like daily_master.xml are not date-sorted.
+                        if pub_timestamp(pub_date) < cutoff_ts:
+                            continue
+                    except Exception:
+                        pass
+                # Canonicalize only items that survived the date filter; stale ones never pay for it.
+                link_key = canonical_link(link)
+                if link_key in seen_links:
+                    continue
+                title = (fields['title'] or "No Title").strip()
+                desc_text = fields['description'] or title
                 all_articles.append({
-                    "id": len(all_articles),
+                    "id": next_id,
                     "title": title,
                     "link": link,
                     "description": desc_text,
                     "pubDate": pub_date
                 })
-                seen_links.add(link)
+                seen_links.add(link_key)
+                next_id += 1
                 items_added += 1
-            print(f"  ✅ Added {items_added} articles from this feed", flush=True)
         except Exception as e:
             print(f"  ❌ Error: {e}", flush=True)
-            continue
+        # A body cut off mid-download must not be cached: its ETag would pin the partial list on every 304.
+        if status == 200 and complete:
+            feed_cache[url] = {
+                "etag": headers.get('ETag'),
+                "last_modified": headers.get('Last-Modified'),
+                "items": raw_items,
+            }
+        print(f"  Found {len(raw_items)} total items", flush=True)
+        print(f"  ✅ Added {items_added} articles from this feed", flush=True)
+    try:
+        save_json_cache(FEED_CACHE_FILE, feed_cache)
+    except OSError as e:
+        print(f"  ❌ Could not write {FEED_CACHE_FILE}: {e}", flush=True)
     print(f"\nTotal Loaded: {len(all_articles)} unique headlines", flush=True)
     return all_articles
 
 # robust extractor
+_FENCE_RE = re.compile(r'```(?:json)?', re.IGNORECASE)
+_SYSTEM_PART = {"text": SYSTEM_PROMPT}
+_JSON_HEADERS = {"Content-Type": "application/json"}
+# Structured output: the model must answer with a bare JSON array of article ids.
+_DECISIONS_SCHEMA = {"type": "ARRAY", "items": {"type": "INTEGER"}}
+_CLUSTERS_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "cluster_id": {"type": "INTEGER"},
+            "main": {"type": "INTEGER"},
+            "members": {"type": "ARRAY", "items": {"type": "INTEGER"}},
+        },
+        "required": ["cluster_id", "main", "members"],
+    },
+}
+_MODEL_URLS = {m['name']: f"{GOOGLE_API_URL}/{m['name']}:generateContent?key={GOOGLE_API_KEY}" for m in MODELS}
+_TRAILING_COMMA_RE = re.compile(r',\s*([}\]])')
+
 def extract_json_from_text(text):
     if not text:
         return None
-    text = re.sub(r'```(?:json)?', '', text, flags=re.IGNORECASE).strip()
+    if '```' in text:
+        text = _FENCE_RE.sub('', text)
+    text = text.strip()
     try:
-        return json.loads(text)
-    except Exception:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
         pass
-    start_idx = None
-    for i, ch in enumerate(text):
-        if ch in '[{':
-            start_idx = i
-            break
-    if start_idx is None:
+    # Trim surrounding prose: take the first opening bracket and its last matching closer.
+    starts = [i for i in (text.find('['), text.find('{')) if i != -1]
+    if not starts:
         return None
-    i = start_idx
-    stack = []
-    in_str = None
-    esc = False
-    while i < len(text):
-        ch = text[i]
-        if in_str:
-            if esc:
-                esc = False
-            elif ch == '\\':
-                esc = True
-            elif ch == in_str:
-                in_str = None
-        else:
-            if ch == '"' or ch == "'":
-                in_str = ch
-            elif ch == '[':
-                stack.append(']')
-            elif ch == '{':
-                stack.append('}')
-            elif ch == ']' or ch == '}':
-                if not stack:
-                    break
-                expected = stack.pop()
-                if ch != expected:
-                    break
-                if not stack:
-                    end_idx = i + 1
-                    candidate = text[start_idx:end_idx]
-                    try:
-                        return json.loads(candidate)
-                    except Exception:
-                        cleaned = re.sub(r',\s*([}\]])', r'\1', candidate)
-                        try:
-                            return json.loads(cleaned)
-                        except Exception:
-                            return None
-        i += 1
-    s = text.find('[')
-    e = text.rfind(']')
-    if s != -1 and e != -1 and e > s:
-        candidate = text[s:e+1]
+    s = min(starts)
+    e = text.rfind(']' if text[s] == '[' else '}')
+    if e <= s:
+        return None
+    candidate = text[s:e+1]
+    for attempt in (candidate, _TRAILING_COMMA_RE.sub(r'\1', candidate)):
         try:
-            return json.loads(candidate)
-        except Exception:
-            try:
-                cleaned = re.sub(r',\s*([}\]])', r'\1', candidate)
-                return json.loads(cleaned)
-            except Exception:
-                return None
+            return orjson.loads(attempt)
+        except orjson.JSONDecodeError:
+            pass
     return None
 
-def call_model(model_info, batch):
+def title_cache_key(model_name, title):
+    # Keyed by title, not id: ids are reassigned every run, titles carry over.
+    h = hashlib.sha256(model_name.encode('utf-8'))
+    h.update(SYSTEM_PROMPT.encode('utf-8'))
+    h.update(title.encode('utf-8'))
+    return h.hexdigest()
+
+def retry_delay(response):
+    # Retry-After header, else the RetryInfo.retryDelay ("37s") Gemini puts in a 429 body.
+    value = response.headers.get('Retry-After', '')
+    if value.isdigit():
+        return int(value)
+    try:
+        for detail in orjson.loads(response.content).get('error', {}).get('details', []):
+            delay = detail.get('retryDelay', '')
+            if delay.endswith('s'):
+                return float(delay[:-1])
+    except (orjson.JSONDecodeError, AttributeError, ValueError):
+        pass
+    return 0
+
+def build_payload(batch, candidate_count=1):
     prompt_list = [f"{a['id']}: {a['title']}" for a in batch]
     prompt_text = "\n".join(prompt_list)
-    api_url = f"{GOOGLE_API_URL}/{model_info['name']}:generateContent?key={GOOGLE_API_KEY}"
-    headers = {"Content-Type": "application/json"}
-    payload = {
+    return {
         "contents": [{
-            "parts": [{
-                "text": f"{SYSTEM_PROMPT}\n\n{prompt_text}"
-            }]
+            "parts": [_SYSTEM_PART, {"text": prompt_text}]
         }],
-        "generationConfig": {"temperature": 0.3}
+        "generationConfig": {
+            "temperature": 0.3,
+            "candidateCount": candidate_count,
+            "responseMimeType": "application/json",
+            "responseSchema": _DECISIONS_SCHEMA,
+        }
     }
-    try:
-        response = requests.post(api_url, headers=headers, json=payload, timeout=90)
+
+def single_run_payload(payload):
+    # Same prompt objects, one candidate: the fallback when a multi-candidate call is rate limited.
+    return {**payload, "generationConfig": {**payload["generationConfig"], "candidateCount": 1}}
+
+def call_model(model_info, payload):
+    api_url = _MODEL_URLS[model_info['name']]
+    candidate_count = payload["generationConfig"]["candidateCount"]
+    body = orjson.dumps(payload)
+    for attempt in range(1, MAX_API_ATTEMPTS + 1):
+        # Jittered exponential backoff for transient failures, added to the usual call spacing so it is never absorbed by it.
+        backoff = MIN_CALL_INTERVAL + API_RETRY_BACKOFF * 2 ** (attempt - 1) * (1 + random.random() * 0.25)
+        wait_for_call_slot()
+        try:
+            response = SESSION.post(api_url, headers=_JSON_HEADERS, data=body, timeout=90)
+        except requests.exceptions.RequestException as e:
+            if attempt < MAX_API_ATTEMPTS:
+                print(f"    [{model_info['display']}] Network Error: {e}. Retrying in {backoff:.0f}s (attempt {attempt}/{MAX_API_ATTEMPTS})", flush=True)
+                defer_next_call(backoff)
+                continue
+            print(f"    [{model_info['display']}] Network Error: {e}. Exiting.", flush=True)
+            sys.exit(1)
         if DEBUG:
             preview = response.text[:2000].replace("\n", " ")
             print(f"    [DEBUG] HTTP {response.status_code} body preview: {preview}", flush=True)
-        if response.status_code == 200:
-            try:
-                response_data = response.json()
-            except Exception as e:
-                print(f"    [{model_info['display']}] Invalid JSON response: {e}", flush=True)
-                sys.exit(1)
-            if 'error' in response_data:
-                print(f"    [{model_info['display']}] API Error: {response_data.get('error')}", flush=True)
-                sys.exit(1)
-            try:
-                candidates = response_data.get('candidates') or response_data.get('outputs') or []
-                if candidates:
-                    content_text = candidates[0]['content']['parts'][0]['text'].strip()
-                else:
-                    content_text = response_data.get('content', '') or response_data.get('output', '')
-            except Exception as e:
-                print(f"    [{model_info['display']}] Response parse error: {e}", flush=True)
-                sys.exit(1)
-            if content_text.startswith("```"):
-                content_text = content_text.replace("```json", "").replace("```", "").strip()
-            parsed_data = extract_json_from_text(content_text)
-            if parsed_data is not None and isinstance(parsed_data, list):
-                return parsed_data
-            else:
-                print(f"    [{model_info['display']}] JSON parse error: model output not a JSON list", flush=True)
-                if DEBUG:
-                    print(f"    [DEBUG] Model output: {content_text}", flush=True)
-                sys.exit(1)
-        elif response.status_code == 429:
-            print(f"    [{model_info['display']}] Rate Limit (429). Exiting.", flush=True)
-            sys.exit(1)
-        elif response.status_code >= 500:
-            print(f"    [{model_info['display']}] Server Error {response.status_code}. Exiting.", flush=True)
+        if response.status_code == 429 and candidate_count > 1:
+            delay = retry_delay(response)
+            print(f"    [{model_info['display']}] Rate Limit (429) on {candidate_count}-candidate request. Falling back to single runs (retry after {delay:.0f}s).", flush=True)
+            defer_next_call(delay)
+            return None
+        if response.status_code == 429 or response.status_code >= 500:
+            label = "Rate Limit (429)" if response.status_code == 429 else f"Server Error {response.status_code}"
+            if attempt < MAX_API_ATTEMPTS:
+                delay = max(retry_delay(response), backoff)
+                print(f"    [{model_info['display']}] {label}. Retrying in {delay:.0f}s (attempt {attempt}/{MAX_API_ATTEMPTS})", flush=True)
+                defer_next_call(delay)
+                continue
+            print(f"    [{model_info['display']}] {label}. Exiting.", flush=True)
             sys.exit(1)
+        break
+    if response.status_code != 200:
+        print(f"    [{model_info['display']}] HTTP Error {response.status_code}. Exiting.", flush=True)
+        if DEBUG:
+            print(f"    [DEBUG] HTTP body: {response.text[:1600]}", flush=True)
+        sys.exit(1)
+    try:
+        response_data = orjson.loads(response.content)
+    except orjson.JSONDecodeError as e:
+        print(f"    [{model_info['display']}] Invalid JSON response: {e}", flush=True)
+        sys.exit(1)
+    if 'error' in response_data:
+        print(f"    [{model_info['display']}] API Error: {response_data.get('error')}", flush=True)
+        sys.exit(1)
+    try:
+        candidates = response_data.get('candidates') or response_data.get('outputs') or []
+        if candidates:
+            content_texts = [c['content']['parts'][0]['text'].strip() for c in candidates]
+        else:
+            content_texts = [response_data.get('content', '') or response_data.get('output', '')]
+    except Exception as e:
+        print(f"    [{model_info['display']}] Response parse error: {e}", flush=True)
+        sys.exit(1)
+    # Every candidate is one run; a short response would leave its articles unable to reach 2 votes.
+    if len(content_texts) != candidate_count:
+        print(f"    [{model_info['display']}] Response format error: expected {candidate_count} candidates, got {len(content_texts)}", flush=True)
+        sys.exit(1)
+    # One decision list per candidate; each candidate counts as one run.
+    runs = []
+    for content_text in content_texts:
+        parsed_data = extract_json_from_text(content_text)
+        if parsed_data is not None and isinstance(parsed_data, list):
+            runs.append(parsed_data)
         else:
-            print(f"    [{model_info['display']}] HTTP Error {response.status_code}. Exiting.", flush=True)
+            print(f"    [{model_info['display']}] JSON parse error: model output not a JSON list", flush=True)
             if DEBUG:
-                print(f"    [DEBUG] HTTP body: {response.text[:1600]}", flush=True)
+                print(f"    [DEBUG] Model output: {content_text}", flush=True)
             sys.exit(1)
-    except requests.exceptions.RequestException as e:
-        print(f"    [{model_info['display']}] Network Error: {e}. Exiting.", flush=True)
-        sys.exit(1)
-    return []
+    return runs
 
 def call_gemini_cluster(all_articles, model_name="gemini-2.5-flash", min_similarity=0.5):
     if not GOOGLE_API_KEY:
@@ -283,14 +495,13 @@ def call_gemini_cluster(all_articles, model_name="gemini-2.5-flash", min_similar
     system = (
         "You are a strict clustering assistant. Input is a tab-separated list: id<TAB>title<TAB>link<TAB>description. "
         f"Cluster headlines that are near-duplicates or strongly about the same event/impact. Only group items when similarity is approximately >= {int(min_similarity*100)}% (i.e. near-50% or greater). "
-        "Choose one main representative per cluster (prefer the clearest title). Output VALID JSON only: an array of objects with fields {\"cluster_id\":int, \"main\":id, \"members\":[ids...]}. No commentary, no markdown, no code fences."
+        "Choose one main representative per cluster (prefer the clearest title): main is its id, members lists every id in the cluster."
     )
     user = f"ARTICLES:\n{content_block}"
     api_url = f"{GOOGLE_API_URL}/{model_name}:generateContent?key={GOOGLE_API_KEY}"
-    headers = {"Content-Type": "application/json"}
-    payload = {"contents": [{"parts": [{"text": system}, {"text": user}]}], "generationConfig": {"temperature": 0.0, "maxOutputTokens": 2000}}
+    payload = {"contents": [{"parts": [{"text": system}, {"text": user}]}], "generationConfig": {"temperature": 0.0, "maxOutputTokens": 2000, "responseMimeType": "application/json", "responseSchema": _CLUSTERS_SCHEMA}}
     try:
-        resp = requests.post(api_url, headers=headers, json=payload, timeout=120)
+        resp = SESSION.post(api_url, headers=_JSON_HEADERS, data=orjson.dumps(payload), timeout=120)
     except requests.exceptions.RequestException as e:
         print(f"Gemini clustering network error: {e}. Exiting.", flush=True)
         sys.exit(1)
@@ -300,8 +511,8 @@ def call_gemini_cluster(all_articles, model_name="gemini-2.5-flash", min_similar
             print(resp.text[:2000], flush=True)
         sys.exit(1)
     try:
-        data = resp.json()
-    except Exception as e:
+        data = orjson.loads(resp.content)
+    except orjson.JSONDecodeError as e:
         print(f"Gemini cluster: invalid JSON response: {e}. Exiting.", flush=True)
         if DEBUG:
             print(resp.text[:2000], flush=True)
@@ -322,7 +533,7 @@ def call_gemini_cluster(all_articles, model_name="gemini-2.5-flash", min_similar
     if text is None:
         text = resp.text
     if text.startswith("```"):
-        text = text.replace("```json", "").replace("```", "").strip()
+        text = _FENCE_RE.sub('', text).strip()
     parsed = extract_json_from_text(text)
     
     # Handle wrapped responses
@@ -359,6 +570,68 @@ def call_gemini_cluster(all_articles, model_name="gemini-2.5-flash", min_similar
         sys.exit(1)
     return validated
 
+# ---------- SIMHASH PRE-CLUSTER ----------
+SIMHASH_MAX_DISTANCE = 3
+
+def title_tokens(text):
+    # Whitespace words with edge punctuation stripped; \w+ would split Bangla words at every vowel sign.
+    tokens = []
+    for word in text.lower().split():
+        start, end = 0, len(word)
+        while start < end and unicodedata.category(word[start])[0] in 'PS':
+            start += 1
+        while end > start and unicodedata.category(word[end - 1])[0] in 'PS':
+            end -= 1
+        if start < end:
+            tokens.append(word[start:end])
+    return tokens
+
+def simhash64(text):
+    votes = [0] * 64
+    for token in title_tokens(text):
+        h = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(64):
+            votes[bit] += 1 if (h >> bit) & 1 else -1
+    return sum(1 << bit for bit in range(64) if votes[bit] > 0)
+
+def precluster_by_simhash(articles, max_distance=SIMHASH_MAX_DISTANCE):
+    # Returns {representative_id: [member_ids]}; the representative is the longest title in the group.
+    hashes = [(a['id'], simhash64(a.get('title') or "")) for a in articles]
+    parent = {aid: aid for aid, _ in hashes}
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+    for i in range(len(hashes)):
+        for j in range(i + 1, len(hashes)):
+            if (hashes[i][1] ^ hashes[j][1]).bit_count() <= max_distance:
+                parent[find(hashes[i][0])] = find(hashes[j][0])
+    groups = {}
+    for a in articles:
+        groups.setdefault(find(a['id']), []).append(a)
+    pre_clusters = {}
+    for members in groups.values():
+        rep = max(members, key=lambda a: len(a.get('title') or ""))
+        pre_clusters[rep['id']] = [a['id'] for a in members]
+    return pre_clusters
+
+def expand_preclusters(clusters, pre_clusters):
+    covered = set()
+    expanded = []
+    for c in clusters:
+        members = []
+        for rid in c['members']:
+            members.extend(pre_clusters.get(rid, [rid]))
+            covered.add(rid)
+        expanded.append({"cluster_id": c['cluster_id'], "main": c['main'], "members": members})
+    next_cid = max((c['cluster_id'] for c in expanded), default=-1) + 1
+    for rid, members in pre_clusters.items():
+        if rid not in covered and len(members) > 1:
+            expanded.append({"cluster_id": next_cid, "main": rid, "members": members})
+            next_cid += 1
+    return expanded
+
 # ---------- MAIN ----------
 def main():
     print("=" * 60, flush=True)
@@ -372,49 +645,106 @@ def main():
         write_feed_xml([], "filter_feed.xml")
         write_feed_xml([], "filter_feed_overflow.xml")
         return
-    model_batches = {}
+    # Votes indexed by article id: a count per article and, once it has any, its run labels.
+    vote_counts = [0] * len(articles)
+    selected_by = [None] * len(articles)
+    def add_vote(aid, label):
+        vote_counts[aid] += 1
+        if selected_by[aid] is None:
+            selected_by[aid] = []
+        selected_by[aid].append(label)
+    # Titles judged within MODEL_CACHE_TTL keep their run picks; expired or malformed entries are dropped here.
+    now_ts = time.time()
+    model_cache = {
+        k: v for k, v in load_json_cache(MODEL_CACHE_FILE).items()
+        if isinstance(v, dict) and isinstance(v.get('picks'), list) and isinstance(v.get('ts'), (int, float))
+        and now_ts - v['ts'] < MODEL_CACHE_TTL
+    }
+    # Near-duplicate headlines are judged once, through their representative.
+    vote_groups = precluster_by_simhash(articles)
+    representatives = [a for a in articles if a['id'] in vote_groups]
+    print(f"\nSimHash dedup: {len(articles)} headlines -> {len(representatives)} to judge", flush=True)
+    # Cached titles vote straight away; only the rest are batched and sent, so every batch is full.
+    # Trade-off: the prompt asks for a relative pick within a batch, so a cached vote reflects the batch the
+    # title was first judged in, not the one it would land in today. Selection can differ from an uncached run.
+    cache_keys = {}
+    pending = {}
     for model_info in MODELS:
-        bs = model_info['batch_size']
-        model_batches[model_info['name']] = [articles[i:i + bs] for i in range(0, len(articles), bs)]
-    max_batch_count = max(len(batches) for batches in model_batches.values())
-    selections_map = {}
+        m_name = model_info['name']
+        cache_keys[m_name] = keys = {a['id']: title_cache_key(m_name, a['title']) for a in representatives}
+        pending[m_name] = []
+        for a in representatives:
+            entry = model_cache.get(keys[a['id']])
+            if entry is None:
+                pending[m_name].append(a)
+            else:
+                for run_num in entry['picks']:
+                    add_vote(a['id'], f"Cached-Run{run_num}")
+        print(f"\n  [{model_info['display']}] {len(representatives) - len(pending[m_name])} titles already judged, {len(pending[m_name])} to send", flush=True)
+    # Only the batch counts up front; each batch is sliced from the pending list when its turn comes.
+    batch_counts = {m['name']: (len(pending[m['name']]) + m['batch_size'] - 1) // m['batch_size'] for m in MODELS}
+    max_batch_count = max(batch_counts.values())
     print(f"\nProcessing {max_batch_count} Batch Groups...", flush=True)
     for batch_idx in range(max_batch_count):
         print(f"\n  Batch Group {batch_idx+1}...", flush=True)
         for model_info in MODELS:
             m_name = model_info['name']
-            if batch_idx >= len(model_batches[m_name]):
+            if batch_idx >= batch_counts[m_name]:
                 print(f"    Skipping {model_info['display']} (no batch)", flush=True)
                 continue
-            batch = model_batches[m_name][batch_idx]
+            bs = model_info['batch_size']
+            batch = pending[m_name][batch_idx * bs:(batch_idx + 1) * bs]
             print(f"    Processing model {model_info['display']} batch {batch_idx+1} (size={len(batch)})", flush=True)
-            for run_num in (1, 2, 3):
-                print(f"    [{model_info['display']}] Run {run_num}/3 start at {now_str()}", flush=True)
-                decisions = call_model(model_info, batch)
+            print(f"    [{model_info['display']}] Runs 1-3 (candidateCount=3) start at {now_str()}", flush=True)
+            payload = build_payload(batch, candidate_count=3)
+            runs = call_model(model_info, payload)
+            if runs is None:
+                runs = []
+                single_payload = single_run_payload(payload)
+                for run_num in (1, 2):
+                    print(f"    [{model_info['display']}] Run {run_num}/3 start at {now_str()}", flush=True)
+                    runs.extend(call_model(model_info, single_payload))
+                # Run 3 can only decide articles with exactly one vote so far; send just those.
+                picked = [{aid for aid in d if isinstance(aid, int)} for d in runs]
+                undecided = [a for a in batch if sum(a['id'] in p for p in picked) == 1]
+                if undecided:
+                    print(f"    [{model_info['display']}] Run 3/3 start at {now_str()} ({len(undecided)} undecided articles)", flush=True)
+                    runs.extend(call_model(model_info, build_payload(undecided)))
+                else:
+                    print(f"    [{model_info['display']}] Runs 1-2 agree on every article, skipping run 3", flush=True)
+            picks = {a['id']: [] for a in batch}
+            for run_num, decisions in enumerate(runs, 1):
                 if decisions:
                     print(f"      [{model_info['display']}] Run {run_num} selected {len(decisions)} articles", flush=True)
                     for aid in decisions:
-                        if isinstance(aid, int) and 0 <= aid < len(articles):
-                            if aid not in selections_map:
-                                selections_map[aid] = {'runs': [], 'count': 0}
-                            selections_map[aid]['runs'].append(f"Batch{batch_idx+1}-Run{run_num}")
-                            selections_map[aid]['count'] += 1
+                        # A run naming the same id twice still casts one vote.
+                        if isinstance(aid, int) and aid in picks and run_num not in picks[aid]:
+                            picks[aid].append(run_num)
                 else:
                     print(f"      [{model_info['display']}] Run {run_num} returned no selections", flush=True)
-                if run_num < 3:
-                    print(f"      Waiting 61s before next run...", flush=True)
-                    time.sleep(61)
-        if batch_idx < max_batch_count - 1:
-            print(f"  Waiting 61s before next batch group...", flush=True)
-            time.sleep(61)
+            # Saved after every batch so a run that exits on an API error keeps what it already paid for.
+            for aid, run_nums in picks.items():
+                model_cache[cache_keys[m_name][aid]] = {"picks": run_nums, "ts": now_ts}
+                for run_num in run_nums:
+                    add_vote(aid, f"Batch{batch_idx+1}-Run{run_num}")
+            try:
+                save_json_cache(MODEL_CACHE_FILE, model_cache)
+            except OSError as e:
+                print(f"    ❌ Could not write {MODEL_CACHE_FILE}: {e}", flush=True)
+    # Every duplicate takes its representative's votes; clustering below groups them again.
+    for rep_id, member_ids in vote_groups.items():
+        for aid in member_ids:
+            if aid != rep_id:
+                vote_counts[aid] = vote_counts[rep_id]
+                selected_by[aid] = selected_by[rep_id]
     final_articles = []
-    for aid, info in selections_map.items():
-        if info['count'] >= 2:
+    for aid, count in enumerate(vote_counts):
+        if count >= 2:
             original = articles[aid].copy()
             original['category'] = 'Geopolitical'
             original['reason'] = 'Geopolitically Significant'
-            original['selected_by'] = info['runs']
-            original['selection_count'] = info['count']
+            original['selected_by'] = selected_by[aid]
+            original['selection_count'] = count
             final_articles.append(original)
     print(f"\n{'='*60}", flush=True)
     print(f"FILTERING: Minimum 2 selections required (out of 3 runs per batch)...", flush=True)
@@ -427,8 +757,12 @@ def main():
         write_feed_xml([], "filter_feed.xml")
         write_feed_xml([], "filter_feed_overflow.xml")
         return
-    print("Sending selected articles to Gemini for single-shot clustering...", flush=True)
-    clusters = call_gemini_cluster(final_articles, model_name=MODELS[0]['name'], min_similarity=0.5)
+    pre_clusters = precluster_by_simhash(final_articles)
+    representatives = [a for a in final_articles if a['id'] in pre_clusters]
+    print(f"SimHash pre-clustering: {len(final_articles)} articles -> {len(representatives)} representatives", flush=True)
+    print("Sending representatives to Gemini for single-shot clustering...", flush=True)
+    clusters = call_gemini_cluster(representatives, model_name=MODELS[0]['name'], min_similarity=0.5)
+    clusters = expand_preclusters(clusters, pre_clusters)
     cluster_map = {}
     used_ids = set()
     for c in clusters:
@@ -444,11 +778,12 @@ def main():
         if art['id'] not in used_ids:
             cluster_map[next_cid] = {"main": art['id'], "members": [art['id']]}
             next_cid += 1
+    by_id = {a['id']: a for a in final_articles}
     clustered_items = []
     for cid, info in cluster_map.items():
         main_id = info['main']
         members = info['members']
-        main_art = next((a for a in final_articles if a['id'] == main_id), None)
+        main_art = by_id.get(main_id)
         if not main_art:
             continue
         similar_html = ""
@@ -456,7 +791,7 @@ def main():
         if sims:
             similar_html += "<p><b>Similar items:</b></p><ul>"
             for sid in sims:
-                art = next((a for a in final_articles if a['id'] == sid), None)
+                art = by_id.get(sid)
                 if art:
                     safe_title = art['title']
                     safe_link = art.get('link', '#')